@@ -0,0 +1,230 @@
+"""Shared on-disk postings codec for the indexer and search components.
+
+Postings are stored as gap-encoded varints instead of decimal text:
+doc IDs in a posting list are ascending, so consecutive gaps are small
+and encode to one or two bytes each (7 data bits per byte, high bit =
+continuation). One record on disk is
+
+    term \\t <blob byte length> \\t <varint blob> \\n
+
+where the blob is varint(doc_gap) varint(tf) pairs. The decimal length
+prefix lets a reader slice or skip a record without decoding the blob.
+"""
+
+import os
+
+import numpy as np
+
+# Optional: a Numba-compiled varint decoder for the query hot path. The
+# pure-Python decoder below stays as the fallback (and is what the
+# indexer's merge uses, since it wants dicts anyway).
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# English stopwords filtered out of both indexed text and queries. The two
+# sides must agree: a stopword kept in a query but absent from the index
+# would make every AND query containing it return nothing.
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are aren as at be because
+been before being below between both but by can cannot could couldn did didn
+do does doesn doing don down during each few for from further had hadn has
+hasn have haven having he her here hers herself him himself his how i if in
+into is isn it its itself just me more most mustn my myself no nor not now of
+off on once only or other our ours ourselves out over own s same shan she
+should shouldn so some such t than that the their theirs them themselves then
+there these they this those through to too under until up very was wasn we
+were weren what when where which while who whom why will with won would
+wouldn you your yours yourself yourselves
+""".split())
+
+
+def iter_json_paths(data_path):
+    """Yield all .json document paths under data_path.
+
+    Recursive os.scandir avoids the extra stat per entry that os.walk
+    pays on some platforms. Shared between the indexer and the
+    doc-map rebuild in search so both visit files in the same order.
+    Doc IDs follow this traversal only because the indexer maps
+    documents with an *ordered* pool (pool.imap); see the main loop in
+    indexer.py before touching either side.
+    """
+    stack = [data_path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".json"):
+                    yield entry.path
+
+
+def _write_varint(buf, n):
+    """Append one varint-encoded non-negative integer to a bytearray."""
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _read_varint(buf, pos):
+    """Decode one varint from buf at pos; return (value, next_pos)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_postings(postings):
+    """Encode a {doc_id: tf} dict into a gap+varint blob.
+
+    Documents are indexed in increasing doc_id order, so the dict's
+    insertion order is normally already ascending and no sort is needed.
+    A negative gap means an out-of-order ID slipped in; encoding then
+    restarts once on a sorted copy.
+    """
+    buf = bytearray()
+    prev_doc_id = 0
+    for doc_id, tf in postings.items():
+        gap = doc_id - prev_doc_id
+        if gap < 0:
+            return encode_postings(dict(sorted(postings.items())))
+        # Fast path: most gaps and tfs fit in one byte (value < 128), so
+        # skip the generic varint loop for them.
+        if gap < 0x80:
+            buf.append(gap)
+        else:
+            _write_varint(buf, gap)
+        if tf < 0x80:
+            buf.append(tf)
+        else:
+            # Saturate at uint16: decoders hand tfs out as uint16 arrays,
+            # and beyond 65535 repetitions the log-scaled weight is flat
+            # anyway.
+            _write_varint(buf, min(tf, 0xFFFF))
+        prev_doc_id = doc_id
+    return bytes(buf)
+
+
+def decode_postings(blob):
+    """Decode a gap+varint blob back into a {doc_id: tf} dict."""
+    postings = {}
+    doc_id = 0
+    pos = 0
+    end = len(blob)
+    while pos < end:
+        gap, pos = _read_varint(blob, pos)
+        tf, pos = _read_varint(blob, pos)
+        doc_id += gap
+        postings[doc_id] = tf
+    return postings
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _decode_pairs_kernel(buf):
+        limit = buf.shape[0]
+        doc_ids = np.empty(limit // 2 + 1, np.int64)
+        tfs = np.empty(limit // 2 + 1, np.uint16)
+        pos = 0
+        doc_id = np.int64(0)
+        count = 0
+        while pos < limit:
+            gap = np.int64(0)
+            shift = 0
+            while True:
+                byte = np.int64(buf[pos])
+                pos += 1
+                gap |= (byte & 0x7F) << shift
+                if byte & 0x80 == 0:
+                    break
+                shift += 7
+            tf = np.int64(0)
+            shift = 0
+            while True:
+                byte = np.int64(buf[pos])
+                pos += 1
+                tf |= (byte & 0x7F) << shift
+                if byte & 0x80 == 0:
+                    break
+                shift += 7
+            doc_id += gap
+            doc_ids[count] = doc_id
+            tfs[count] = tf
+            count += 1
+        return doc_ids[:count], tfs[:count]
+else:
+    _decode_pairs_kernel = None
+
+
+def decode_postings_arrays(blob):
+    """Decode a postings blob into parallel (doc_ids, tfs) numpy arrays.
+
+    Doc IDs come out ascending because the blob is gap-encoded. tfs are
+    uint16 (the encoder saturates there), halving their footprint and
+    doubling cache-line density during scoring. Uses the Numba kernel
+    when available; otherwise decodes in pure Python.
+    """
+    if _decode_pairs_kernel is not None:
+        return _decode_pairs_kernel(np.frombuffer(blob, dtype=np.uint8))
+
+    postings = decode_postings(blob)
+    doc_ids = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+    tfs = np.fromiter(postings.values(), dtype=np.uint16, count=len(postings))
+    return doc_ids, tfs
+
+
+def write_record(f, term, blob):
+    """Write one term record to a binary postings file.
+
+    Returns (blob_offset, blob_length) so callers can build a
+    term -> file-offset dictionary for direct seeks.
+    """
+    header = term.encode("utf-8") + b"\t" + str(len(blob)).encode("ascii") + b"\t"
+    blob_offset = f.tell() + len(header)
+    f.write(header + blob + b"\n")
+    return blob_offset, len(blob)
+
+
+def iter_records(f, chunk_size=1 << 20):
+    """Yield (term, blob) records from a binary postings file.
+
+    Blobs may contain tab/newline bytes, so records are re-framed via
+    the length prefix rather than by line splitting.
+    """
+    buf = bytearray()
+    pos = 0
+    while True:
+        first_tab = buf.find(b"\t", pos)
+        second_tab = buf.find(b"\t", first_tab + 1) if first_tab != -1 else -1
+
+        if second_tab == -1:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            del buf[:pos]
+            pos = 0
+            buf += chunk
+            continue
+
+        blob_len = int(buf[first_tab + 1:second_tab])
+        record_end = second_tab + 1 + blob_len + 1  # blob plus trailing newline
+
+        if len(buf) < record_end:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break  # truncated trailing record
+            buf += chunk
+            continue
+
+        term = buf[pos:first_tab].decode("utf-8")
+        blob = bytes(buf[second_tab + 1:record_end - 1])
+        yield term, blob
+        pos = record_end
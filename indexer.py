@@ -1,10 +1,33 @@
+import heapq
+import itertools
+import math
 import os
 import json
 import re
-import nltk
-from bs4 import BeautifulSoup
-from nltk.stem import PorterStemmer
-from collections import defaultdict
+import multiprocessing as mp
+import sqlite3
+import numpy as np
+import orjson
+import Stemmer
+from selectolax.parser import HTMLParser
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from index_common import (
+    STOPWORDS,
+    decode_postings,
+    encode_postings,
+    iter_json_paths,
+    iter_records,
+    write_record,
+)
+
+# Optional: a MARISA trie stores the term dictionary in ~50x less RAM than
+# a dict of str keys. The JSON sidecar is always written as fallback.
+try:
+    import marisa_trie
+except ImportError:
+    marisa_trie = None
 
 """Indexer for Assignment 3.
 
@@ -20,9 +43,39 @@ Pipeline:
 
 DATA_PATH = "DEV"
 
-MAX_TERMS_IN_MEMORY = 50000
-
-stemmer = PorterStemmer()
+# Flush budget counted in total postings (doc_id, tf) held in memory, a
+# closer proxy for RAM than the number of distinct terms. When the whole
+# corpus fits under the budget, no partial files are written and the merge
+# pass is skipped entirely.
+MAX_POSTINGS_IN_MEMORY = 5_000_000
+
+# Also persist the final index as a SQLite key-value table. Optional
+# alternate backend: term lookups become a B-tree probe instead of the
+# offsets sidecar, handy when the sidecar files are inconvenient to ship.
+WRITE_SQLITE_INDEX = False
+
+# Compiled once at import; re.ASCII keeps the character class on the fast
+# byte-oriented matching path. The bound method skips an attribute lookup
+# on every tokenize call.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+", re.ASCII)
+_token_findall = _TOKEN_RE.findall
+
+# Snowball (PyStemmer) implementation of Porter: the stemWords batch call
+# stems a whole token list in one C call instead of one Python call per token.
+stemmer = Stemmer.Stemmer('porter')
+_stem_words = stemmer.stemWords
+
+# Optional GPU stemmer (RAPIDS cuML). Used only for batches large enough to
+# amortize the host<->device transfer; anything else goes to the CPU path.
+try:
+    import cudf
+    from cuml.preprocessing.text.stem import PorterStemmer as GPUPorterStemmer
+    gpu_stemmer = GPUPorterStemmer()
+except ImportError:
+    cudf = None
+    gpu_stemmer = None
+
+GPU_STEM_MIN_BATCH = 512
 
 
 def strip_fragment(url):
@@ -34,119 +87,229 @@ def strip_fragment(url):
 
 def extract_text_from_html(html_content):
     """Extract full visible text and boosted-important text from HTML."""
-    soup = BeautifulSoup(html_content, 'lxml')
-    # Keep important fields separately so they can be weighted higher.
-    important_text = []
-    
-    # Title
-    title = soup.find('title')
-    if title:
-        important_text.append(title.get_text())
-    
-    # Headings (h1, h2, h3)
-    for heading in soup.find_all(['h1', 'h2', 'h3']):
-        important_text.append(heading.get_text())
-    
-    # Bold text
-    for bold in soup.find_all(['b', 'strong']):
-        important_text.append(bold.get_text())
-    
-    return soup.get_text(separator=' '), ' '.join(important_text)
+    tree = HTMLParser(html_content)
+
+    # Script/style bodies only produce garbage tokens; drop them before
+    # any text extraction.
+    for node in tree.css('script, style, noscript, template, svg'):
+        node.decompose()
+
+    # Title / headings / bold are kept separately so they can be weighted
+    # higher by the indexer.
+    important_text = [
+        node.text(separator=' ')
+        for node in tree.css('title, h1, h2, h3, b, strong')
+    ]
+
+    body_text = tree.body.text(separator=' ') if tree.body else ''
+    return body_text, ' '.join(important_text)
 
 
 def tokenize(text):
     """Split text into lowercase alphanumeric tokens."""
-    tokens = re.findall(r"[a-zA-Z0-9]+", text.lower())
-    return tokens
+    return _token_findall(text.lower())
 
 
 def stem_tokens(tokens):
-    """Apply Porter stemming to each token."""
-    result = []
-    for token in tokens:
-        result.append(stemmer.stem(token))
-    return result
+    """Apply Porter stemming to a list of tokens.
+
+    Large batches go through the cuML GPU stemmer when available;
+    otherwise (or for small batches) the Snowball CPU stemmer is used.
+    """
+    if gpu_stemmer is not None and len(tokens) >= GPU_STEM_MIN_BATCH:
+        return gpu_stemmer.stem(cudf.Series(tokens)).to_pandas().tolist()
+    return _stem_words(tokens)
 
 
-def build_index_for_one_doc(doc_id, tokens, important_tokens, inverted_index):
+def build_term_freq(tokens, important_tokens):
     """Build weighted term frequencies for a single document.
 
-    Normal tokens contribute +1, important tokens contribute +5.
+    Takes raw (unstemmed) tokens, counts them first, and stems each
+    unique surface form only once -- Zipf's law means the same token
+    repeats many times per document, so this cuts stemmer calls by the
+    average repetition factor. Counting itself is done by Counter's
+    C implementation rather than a Python increment loop.
+
+    Normal tokens contribute +1 per occurrence. Important tokens add +4
+    on top: they normally also appear in the body text, so the effective
+    weight of an important occurrence stays 5.
+    """
+    token_counts = Counter(tokens)
+    important_counts = Counter(important_tokens)
+
+    # Drop stopwords after counting so the membership test runs once per
+    # unique token, not once per occurrence.
+    for stop in STOPWORDS.intersection(token_counts):
+        del token_counts[stop]
+    for stop in STOPWORDS.intersection(important_counts):
+        del important_counts[stop]
+
+    term_freq = Counter()
+    for stem, count in zip(stem_tokens(list(token_counts)), token_counts.values()):
+        term_freq[stem] += count
+
+    for stem, count in zip(stem_tokens(list(important_counts)), important_counts.values()):
+        term_freq[stem] += 4 * count
+
+    return term_freq
+
+
+def process_document(raw):
+    """Worker: parse one crawled JSON document into (url, {term: tf}).
+
+    Takes the raw file bytes (already read by the I/O stage), so it can
+    run in a worker process; the main process only assigns doc IDs and
+    merges results.
     """
-    term_freq = defaultdict(int)
-    
-    # Regular tokens count as 1
-    for token in tokens:
-        term_freq[token] += 1
-    
-    # Important tokens count as 5 (boost factor)
-    for token in important_tokens:
-        term_freq[token] += 5
-    
-    for term, tf in term_freq.items():
-        inverted_index[term][doc_id] = tf
+    data = orjson.loads(raw)
+
+    url = strip_fragment(data.get("url", ""))
+
+    text, important_text = extract_text_from_html(data['content'])
+
+    # Stemming happens inside build_term_freq, on unique tokens only.
+    return url, dict(build_term_freq(tokenize(text), tokenize(important_text)))
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_file_bytes(paths, max_workers=8, prefetch=256):
+    """Read files through a thread pool, yielding raw bytes.
+
+    The reader stage keeps the disk queue full while worker processes do
+    the CPU-bound parsing; prefetch bounds how many files sit in memory
+    waiting to be consumed.
+    """
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(
+            executor.submit(_read_bytes, path)
+            for path in itertools.islice(paths, prefetch)
+        )
+        for path in paths:
+            yield pending.popleft().result()
+            pending.append(executor.submit(_read_bytes, path))
+        while pending:
+            yield pending.popleft().result()
 
 
 def write_partial_index(inverted_index, part_num):
     """Write one in-memory chunk of inverted index to disk."""
     os.makedirs("partial_indexes", exist_ok=True)
-    filename = f"partial_indexes/partial_{part_num}.txt"
-    with open(filename, "w", encoding="utf-8") as f:
+    filename = f"partial_indexes/partial_{part_num}.bin"
+    with open(filename, "wb") as f:
         for term in sorted(inverted_index.keys()):
-            postings = inverted_index[term]
-            # term: docID1 tf1 docID2 tf2 ...
-            postings_str = " ".join(
-                f"{doc_id} {postings[doc_id]}" 
-                for doc_id in sorted(postings.keys())
-            )
-            f.write(f"{term}: {postings_str}\n")
+            write_record(f, term, encode_postings(inverted_index[term]))
     print(f"Written partial index {filename}")
 
 
-def merge_partials():
-    """Merge all partial index files into one final in-memory index."""
-    find_index = defaultdict(dict)
-    partial_path = "partial_indexes"
-    print("Merging partial indexes...")
-
-    for filename in sorted(os.listdir(partial_path)):
-        print("Merging:", filename)  # DEBUG
-        if filename.startswith("partial_"):
-            filepath = os.path.join(partial_path, filename)
-
-            with open(filepath, "r", encoding="utf-8") as f:
-                for line in f:
-                    if ":" not in line:
-                        continue
-
-                    term, postings_str = line.strip().split(":", 1)
-                    postings_list = postings_str.strip().split()
+def iter_partial_records(filepath):
+    """Yield (term, blob) records from one sorted partial file."""
+    with open(filepath, "rb") as f:
+        yield from iter_records(f)
 
-                    if len(postings_list) % 2 != 0:
-                        continue
 
-                    # Parse postings as docID/tf pairs.
-                    for i in range(0, len(postings_list), 2):
-                        try:
-                            doc_id = int(postings_list[i])
-                            tf = int(postings_list[i+1])
-                            find_index[term][doc_id] = tf
-                        except:
-                            continue
-    return find_index
+def merge_partials():
+    """Stream-merge sorted partial files, yielding (term, postings) per term.
 
+    Each partial file is already sorted by term, so heapq.merge gives a
+    k-way merge over all of them; postings for a term are accumulated
+    across consecutive same-term records and emitted as soon as the term
+    changes. The full index is never materialized in memory.
+    """
+    partial_path = "partial_indexes"
+    print("Merging partial indexes...")
 
-def write_final_index(find_index):
-    """Persist merged inverted index to final_index/final_index.txt."""
+    # Numeric order (not lexical: partial_10 sorts before partial_2) so a
+    # term's postings accumulate in ascending doc_id order across runs.
+    filenames = sorted(
+        (fn for fn in os.listdir(partial_path) if fn.startswith("partial_")),
+        key=lambda fn: int(fn.split("_")[1].split(".")[0]),
+    )
+    streams = [
+        iter_partial_records(os.path.join(partial_path, filename))
+        for filename in filenames
+    ]
+
+    current_term = None
+    current_postings = {}
+
+    for term, blob in heapq.merge(*streams, key=lambda record: record[0]):
+        if term != current_term:
+            if current_term is not None:
+                yield current_term, current_postings
+            current_term = term
+            current_postings = {}
+
+        for doc_id, tf in decode_postings(blob).items():
+            current_postings[doc_id] = current_postings.get(doc_id, 0) + tf
+
+    if current_term is not None:
+        yield current_term, current_postings
+
+
+def write_final_index(merged_records, total_docs):
+    """Stream merged (term, postings) records to final_index/final_index.bin.
+
+    Also writes a term -> (blob_offset, blob_length) sidecar so search can
+    seek straight to a term's postings instead of scanning the whole file,
+    and a precomputed smoothed-IDF table so queries never touch math.log.
+    Returns the number of unique terms written.
+    """
     os.makedirs("final_index", exist_ok=True)
 
-    filename = "final_index/final_index.txt"
-    with open(filename, "w", encoding="utf-8") as f:
-        for term in sorted(find_index.keys()):
-            postings = find_index[term] # {doc_id: tf, ...}
-            postings_str = " ".join(f"{doc_id} {tf}" for doc_id, tf in sorted(postings.items())) # term: docID1 tf1 docID2 tf2 ...
-            f.write(f"{term}: {postings_str}\n")
+    db = None
+    db_rows = []
+    if WRITE_SQLITE_INDEX:
+        db_path = "final_index/final_index.sqlite"
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = sqlite3.connect(db_path)
+        db.execute("CREATE TABLE idx(term TEXT PRIMARY KEY, postings BLOB)")
+
+    filename = "final_index/final_index.bin"
+    offsets = {}
+    idf = {}
+    max_tf = {}
+    with open(filename, "wb") as f:
+        for term, postings in merged_records:
+            blob = encode_postings(postings)
+            offsets[term] = write_record(f, term, blob)
+            # Smoothed IDF, matching the query-time formula.
+            idf[term] = math.log((total_docs + 1) / (len(postings) + 1)) + 1.0
+            # Per-term score ceiling input for MaxScore pruning at query time.
+            max_tf[term] = max(postings.values())
+
+            if db is not None:
+                db_rows.append((term, blob))
+                if len(db_rows) >= 10_000:
+                    db.executemany("INSERT INTO idx VALUES (?, ?)", db_rows)
+                    db_rows.clear()
+
+    if db is not None:
+        if db_rows:
+            db.executemany("INSERT INTO idx VALUES (?, ?)", db_rows)
+        db.commit()
+        db.close()
+
+    with open("final_index/offsets.json", "w", encoding="utf-8") as f:
+        json.dump(offsets, f, ensure_ascii=False)
+
+    with open("final_index/idf.json", "w", encoding="utf-8") as f:
+        json.dump(idf, f, ensure_ascii=False)
+
+    with open("final_index/max_tf.json", "w", encoding="utf-8") as f:
+        json.dump(max_tf, f, ensure_ascii=False)
+
+    if marisa_trie is not None:
+        trie = marisa_trie.RecordTrie("<QQ", offsets.items())
+        trie.save("final_index/term_index.marisa")
+
     print("Final index written to disk.")
+    return len(offsets)
 
 
 if __name__ == "__main__":
@@ -154,62 +317,97 @@ if __name__ == "__main__":
     inverted_index = defaultdict(dict)
     # Needed by retrieval to convert result doc IDs back to URLs.
     doc_id_to_url = {}
+    # Fragment-stripped URL -> canonical doc_id: #fragment variants of the
+    # same page fold into one document instead of duplicating results.
+    url_to_doc_id = {}
     doc_id = 1
     part_num = 1
+    postings_in_memory = 0
 
     # Ensure a clean rebuild of partial indexes.
     if os.path.isdir("partial_indexes"):
         for filename in os.listdir("partial_indexes"):
-            if filename.startswith("partial_") and filename.endswith(".txt"):
+            if filename.startswith("partial_") and filename.endswith(".bin"):
                 try:
                     os.remove(os.path.join("partial_indexes", filename))
                 except OSError:
                     pass
 
     print("Starting document processing...")
-    for root, dirs, files in os.walk(DATA_PATH):
-        for file in files:
-            if file.endswith(".json"):
-                path = os.path.join(root, file)
-                with open(path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                doc_id_to_url[doc_id] = strip_fragment(data.get("url", ""))
-                    
-                text, important_text = extract_text_from_html(data['content'])
-                tokens = tokenize(text)
-                tokens = stem_tokens(tokens)
-                
-                important_tokens = tokenize(important_text)
-                important_tokens = stem_tokens(important_tokens)
-                
-                build_index_for_one_doc(doc_id, tokens, important_tokens, inverted_index)
-                doc_id += 1
-
-                # Flush to disk when term dictionary gets too large.
-                if len(inverted_index) >= MAX_TERMS_IN_MEMORY:
-                    print("Writing partial index:", part_num)
-                    write_partial_index(inverted_index, part_num)
-                    inverted_index.clear()
-                    part_num += 1
-
-    # Write the remaining in-memory terms.
-    if inverted_index:
-        write_partial_index(inverted_index, part_num)   
+
+    # Two-stage pipeline: a thread pool keeps file reads ahead of the
+    # CPU-bound parse/tokenize/stem work fanned out across cores; the
+    # main process only assigns doc IDs and merges. The ordered imap is
+    # deliberate: results come back in iter_json_paths traversal order,
+    # so doc IDs are deterministic and the doc-map rebuild in search can
+    # reproduce the assignment. With chunksize batching the ordered
+    # variant costs nothing over imap_unordered.
+    raw_docs = iter_file_bytes(iter_json_paths(DATA_PATH))
+    with mp.Pool(os.cpu_count()) as pool:
+        for url, tf_map in pool.imap(process_document, raw_docs, chunksize=32):
+            canonical_id = url_to_doc_id.get(url) if url else None
+            if canonical_id is not None:
+                # Duplicate URL (fragment variant): merge into the
+                # canonical document rather than minting a new doc_id.
+                for term, tf in tf_map.items():
+                    postings = inverted_index[term]
+                    postings[canonical_id] = postings.get(canonical_id, 0) + tf
+                postings_in_memory += len(tf_map)
+                continue
+
+            if url:
+                url_to_doc_id[url] = doc_id
+            doc_id_to_url[doc_id] = url
+
+            for term, tf in tf_map.items():
+                inverted_index[term][doc_id] = tf
+            postings_in_memory += len(tf_map)
+            doc_id += 1
+
+            # Flush to disk when the in-memory postings exceed the budget.
+            if postings_in_memory >= MAX_POSTINGS_IN_MEMORY:
+                print("Writing partial index:", part_num)
+                write_partial_index(inverted_index, part_num)
+                inverted_index.clear()
+                postings_in_memory = 0
+                part_num += 1
+
+    total_docs = doc_id - 1
+
+    if part_num == 1:
+        # The whole corpus fit in one in-memory run: write the final index
+        # directly and skip the partial write + merge pass.
+        unique_terms = write_final_index(
+            ((term, inverted_index[term]) for term in sorted(inverted_index)),
+            total_docs,
+        )
         inverted_index.clear()
+    else:
+        # Write the remaining in-memory terms, then merge all runs.
+        if inverted_index:
+            write_partial_index(inverted_index, part_num)
+            inverted_index.clear()
 
-    print("Merging partial indexes...")
-    final_index = merge_partials()
-    write_final_index(final_index)
+        unique_terms = write_final_index(merge_partials(), total_docs)
 
-    # Save doc_id -> URL mapping used by search.py.
+    # Save doc_id -> URL mapping used by search.py. The line-indexed file
+    # plus offsets array lets search read single URLs on demand instead of
+    # holding every URL in RAM; the JSON map is kept for compatibility.
     os.makedirs("final_index", exist_ok=True)
     with open("final_index/doc_id_map.json", "w", encoding="utf-8") as f:
         json.dump(doc_id_to_url, f, ensure_ascii=False)
-    print("Document ID to URL map written to final_index/doc_id_map.json")
 
-    print("Total documents:", doc_id - 1)
-    print("Unique tokens:", len(final_index))
+    url_offsets = np.zeros(total_docs + 2, dtype=np.uint64)
+    with open("final_index/doc_urls.txt", "wb") as f:
+        for i in range(1, total_docs + 1):
+            url_offsets[i] = f.tell()
+            f.write(doc_id_to_url.get(i, "").encode("utf-8") + b"\n")
+        url_offsets[total_docs + 1] = f.tell()
+    np.save("final_index/doc_url_offsets.npy", url_offsets)
+    print("Document ID to URL map written to final_index/")
+
+    print("Total documents:", total_docs)
+    print("Unique tokens:", unique_terms)
 
-    size_kb = os.path.getsize("final_index/final_index.txt") / 1024
+    size_kb = os.path.getsize("final_index/final_index.bin") / 1024
     print("Index size (KB):", round(size_kb, 2))
\ No newline at end of file
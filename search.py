@@ -1,11 +1,26 @@
 import argparse
+import concurrent.futures
+import functools
 import json
 import math
+import mmap
+import multiprocessing as mp
 import os
 import re
+import sqlite3
+import orjson
 from collections import defaultdict
 
-from nltk.stem import PorterStemmer
+import numpy as np
+import Stemmer
+
+from index_common import STOPWORDS, decode_postings_arrays, iter_json_paths
+
+# Optional compact term dictionary; see write_final_index in indexer.py.
+try:
+    import marisa_trie
+except ImportError:
+    marisa_trie = None
 
 
 """Milestone 2 retrieval component.
@@ -21,8 +36,19 @@ Features:
 DATA_PATH = "DEV"
 PARTIAL_INDEX_DIR = "partial_indexes"
 FINAL_INDEX_DIR = "final_index"
-FINAL_INDEX_FILE = os.path.join(FINAL_INDEX_DIR, "final_index.txt")
+FINAL_INDEX_FILE = os.path.join(FINAL_INDEX_DIR, "final_index.bin")
+SQLITE_INDEX_PATH = os.path.join(FINAL_INDEX_DIR, "final_index.sqlite")
+OFFSETS_PATH = os.path.join(FINAL_INDEX_DIR, "offsets.json")
+IDF_PATH = os.path.join(FINAL_INDEX_DIR, "idf.json")
+MAX_TF_PATH = os.path.join(FINAL_INDEX_DIR, "max_tf.json")
+
+# Candidate sets smaller than this are scored outright; pruning overhead
+# only pays for itself on broad queries.
+MAXSCORE_MIN_CANDIDATES = 1024
+TERM_TRIE_PATH = os.path.join(FINAL_INDEX_DIR, "term_index.marisa")
 DOC_MAP_PATH = os.path.join(FINAL_INDEX_DIR, "doc_id_map.json")
+DOC_URLS_PATH = os.path.join(FINAL_INDEX_DIR, "doc_urls.txt")
+DOC_URL_OFFSETS_PATH = os.path.join(FINAL_INDEX_DIR, "doc_url_offsets.npy")
 
 MILESTONE_QUERIES = [
     "cristina lopes",
@@ -31,7 +57,20 @@ MILESTONE_QUERIES = [
     "master of software engineering",
 ]
 
-stemmer = PorterStemmer()
+# Snowball (PyStemmer) implementation of Porter, same as the indexer.
+stemmer = Stemmer.Stemmer('porter')
+
+# Bound once so the hot query-normalization path avoids repeated global
+# attribute lookups.
+_is_stopword = STOPWORDS.__contains__
+
+# Compiled once at import, matching the indexer's tokenizer.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+", re.ASCII)
+_token_findall = _TOKEN_RE.findall
+
+# Stems are deterministic, so memoizing them is safe; interactive
+# sessions and the milestone queries repeat terms constantly.
+_stem = functools.lru_cache(maxsize=200_000)(stemmer.stemWord)
 
 
 def strip_fragment(url):
@@ -43,20 +82,67 @@ def strip_fragment(url):
 
 def tokenize(text):
     """Split raw text into lowercase alphanumeric tokens."""
-    return re.findall(r"[a-zA-Z0-9]+", text.lower())
+    return _token_findall(text.lower())
 
 
 def stem_tokens(tokens):
-    """Apply Porter stemming to each token."""
-    return [stemmer.stem(token) for token in tokens]
+    """Apply Porter stemming to a list of tokens, memoized per token."""
+    return [_stem(token) for token in tokens]
 
 
 def normalize_query(query):
-    """Normalize query by tokenizing and stemming (no stopword removal)."""
-    tokens = tokenize(query)
+    """Normalize query: tokenize, drop stopwords, stem.
+
+    Stopwords must be removed here because the indexer does not index
+    them; keeping one in an AND query would empty the result set.
+    """
+    tokens = [token for token in tokenize(query) if not _is_stopword(token)]
     return stem_tokens(tokens)
 
 
+class DocUrlMap:
+    """Lazy doc_id -> URL lookup over the line-indexed doc_urls file.
+
+    Presents the same .get()/len() surface as the in-memory dict, but
+    only the handful of URLs actually shown per query are ever read,
+    so startup I/O and resident memory stay O(1) in the corpus size.
+    """
+
+    def __init__(self, offsets, mm):
+        self._offsets = offsets
+        self._mm = mm
+
+    def __len__(self):
+        return len(self._offsets) - 2
+
+    def get(self, doc_id, default=""):
+        if not 1 <= doc_id <= len(self):
+            return default
+        start = int(self._offsets[doc_id])
+        end = int(self._offsets[doc_id + 1]) - 1  # strip trailing newline
+        return self._mm[start:end].decode("utf-8")
+
+
+def load_doc_url_map():
+    """Return the doc_id -> URL lookup, preferring the lazy file-backed map."""
+    if os.path.exists(DOC_URLS_PATH) and os.path.exists(DOC_URL_OFFSETS_PATH):
+        offsets = np.load(DOC_URL_OFFSETS_PATH)
+        if len(offsets) > 2:
+            with open(DOC_URLS_PATH, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return DocUrlMap(offsets, mm)
+    return build_doc_id_map_if_missing()
+
+
+def _read_url(path):
+    """Read one crawl JSON and return its fragment-stripped URL."""
+    try:
+        with open(path, "rb") as f:
+            return strip_fragment(orjson.loads(f.read()).get("url", ""))
+    except Exception:
+        return ""
+
+
 def build_doc_id_map_if_missing():
     """Load doc_id -> URL map from disk, or build it from DEV if missing.
 
@@ -69,22 +155,26 @@ def build_doc_id_map_if_missing():
         return {int(doc_id): strip_fragment(url) for doc_id, url in raw.items()}
 
     os.makedirs(FINAL_INDEX_DIR, exist_ok=True)
-    doc_id_to_url = {}
-    doc_id = 1
 
     print("Building doc_id -> URL map from DEV/... (one-time)")
-    for root, _, files in os.walk(DATA_PATH):
-        for file in files:
-            if not file.endswith(".json"):
+    paths = list(iter_json_paths(DATA_PATH))
+
+    # Each file is read only for its "url" field; the work is almost
+    # entirely file I/O, so a thread pool overlaps the reads while
+    # ex.map keeps results in path order. Doc IDs must match the
+    # indexer's assignment, which this reproduces piece by piece: the
+    # same traversal (iter_json_paths), in traversal order (the indexer
+    # uses ordered pool.imap for exactly this reason), with the same
+    # folding of repeated URLs into their first doc ID.
+    doc_id_to_url = {}
+    seen_urls = set()
+    doc_id = 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=32) as ex:
+        for url in ex.map(_read_url, paths):
+            if url and url in seen_urls:
                 continue
-
-            path = os.path.join(root, file)
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                doc_id_to_url[doc_id] = strip_fragment(data.get("url", ""))
-            except Exception:
-                doc_id_to_url[doc_id] = ""
+            seen_urls.add(url)
+            doc_id_to_url[doc_id] = url
             doc_id += 1
 
     with open(DOC_MAP_PATH, "w", encoding="utf-8") as f:
@@ -94,151 +184,450 @@ def build_doc_id_map_if_missing():
     return doc_id_to_url
 
 
-def parse_postings_line(line):
-    """Parse a postings line: 'term: docID1 tf1 docID2 tf2 ...'."""
-    term, postings_str = line.strip().split(":", 1)
-    entries = postings_str.strip().split()
-    postings = {}
+# Lazily-initialized handles for the final index; loaded once per process.
+_term_offsets = None
+_final_index_mmap = None
+_idf_table = None
+_max_tf_table = None
+_sqlite_index = None
 
-    if len(entries) % 2 != 0:
-        return term, postings
 
-    for i in range(0, len(entries), 2):
-        try:
-            doc_id = int(entries[i])
-            tf = int(entries[i + 1])
-            postings[doc_id] = tf
-        except ValueError:
-            continue
+def _get_sqlite_index():
+    """Open the optional SQLite index (see WRITE_SQLITE_INDEX in indexer.py), once."""
+    global _sqlite_index
+    if _sqlite_index is None:
+        _sqlite_index = sqlite3.connect(f"file:{SQLITE_INDEX_PATH}?mode=ro", uri=True)
+    return _sqlite_index
+
+
+def _get_max_tf_table():
+    """Load the term -> max term frequency table, once.
+
+    Empty when the index predates it; pruning is then skipped.
+    """
+    global _max_tf_table
+    if _max_tf_table is None:
+        if os.path.exists(MAX_TF_PATH):
+            with open(MAX_TF_PATH, "rb") as f:
+                _max_tf_table = orjson.loads(f.read())
+        else:
+            _max_tf_table = {}
+    return _max_tf_table
+
+
+def _get_idf_table():
+    """Load the precomputed term -> smoothed-IDF table, once.
+
+    Empty when the index predates the table; and_search then falls back
+    to computing IDF from document frequency.
+    """
+    global _idf_table
+    if _idf_table is None:
+        if os.path.exists(IDF_PATH):
+            with open(IDF_PATH, "rb") as f:
+                _idf_table = orjson.loads(f.read())
+        else:
+            _idf_table = {}
+    return _idf_table
+
+
+class _TrieOffsets:
+    """Adapter giving a RecordTrie the same .get(term) as the offsets dict."""
+
+    def __init__(self, trie):
+        self._trie = trie
+
+    def get(self, term):
+        hits = self._trie.get(term)
+        return hits[0] if hits else None
+
+
+def _get_term_offsets():
+    """Load the term -> (blob_offset, blob_length) dictionary, once.
+
+    Prefers the MARISA trie (far smaller in RAM); falls back to the JSON
+    sidecar when the trie file or the marisa_trie package is absent.
+    """
+    global _term_offsets
+    if _term_offsets is None:
+        if marisa_trie is not None and os.path.exists(TERM_TRIE_PATH):
+            trie = marisa_trie.RecordTrie("<QQ")
+            trie.load(TERM_TRIE_PATH)
+            _term_offsets = _TrieOffsets(trie)
+        else:
+            with open(OFFSETS_PATH, "r", encoding="utf-8") as f:
+                _term_offsets = {term: tuple(entry) for term, entry in json.load(f).items()}
+    return _term_offsets
+
+
+def _get_final_index_mmap():
+    """Memory-map final_index.bin, once."""
+    global _final_index_mmap
+    if _final_index_mmap is None:
+        with open(FINAL_INDEX_FILE, "rb") as f:
+            _final_index_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return _final_index_mmap
+
+
+def _get_final_index_view():
+    """Memoryview over the mapped index: slicing it copies nothing."""
+    return memoryview(_get_final_index_mmap())
+
+
+_EMPTY_POSTINGS = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16))
 
-    return term, postings # {doc_id: tf, ...}
+# Log-scaled tf weights, precomputed once: tfs are uint16, so 65536
+# float32 entries cover every possible value and scoring becomes a pure
+# table gather with no transcendental calls at query time. Entry 0 is
+# never hit on the AND path (every candidate carries every term) but is
+# kept at 0 so a stray zero tf scores as nothing rather than -inf.
+_LOG_TF = np.empty(65536, dtype=np.float32)
+_LOG_TF[0] = 0.0
+_LOG_TF[1:] = 1.0 + np.log(np.arange(1, 65536, dtype=np.float32))
+
+
+def _merge_term_arrays(pairs):
+    """Sum tfs across several (doc_ids, tfs) array pairs for one term."""
+    doc_ids = np.concatenate([doc_ids for doc_ids, _ in pairs])
+    tfs = np.concatenate([tfs for _, tfs in pairs])
+    unique_ids, inverse = np.unique(doc_ids, return_inverse=True)
+    summed = np.bincount(inverse, weights=tfs)
+    # Saturate like the encoder does: tfs stay uint16 everywhere.
+    return unique_ids, np.minimum(summed, 0xFFFF).astype(np.uint16)
+
+
+def build_term_offsets_if_missing():
+    """Rebuild the offsets sidecar from final_index.bin if it is absent.
+
+    Covers indexes built before the sidecar existed: one framing-only
+    scan (blobs are never decoded) instead of a full scan per query.
+    """
+    if os.path.exists(OFFSETS_PATH) or os.path.exists(TERM_TRIE_PATH):
+        return
+
+    offsets = {}
+    mm = _get_final_index_mmap()
+    size = len(mm)
+    pos = 0
+    while pos < size:
+        first_tab = mm.find(b"\t", pos)
+        if first_tab == -1:
+            break
+        second_tab = mm.find(b"\t", first_tab + 1)
+        blob_len = int(mm[first_tab + 1:second_tab])
+        term = mm[pos:first_tab].decode("utf-8")
+        offsets[term] = (second_tab + 1, blob_len)
+        pos = second_tab + 1 + blob_len + 1
+
+    with open(OFFSETS_PATH, "w", encoding="utf-8") as f:
+        json.dump(offsets, f, ensure_ascii=False)
+    print(f"Rebuilt term offsets for {len(offsets)} terms -> {OFFSETS_PATH}")
+
+
+@functools.lru_cache(maxsize=2048)
+def _load_one_term(term):
+    """Load one term's postings from the final index, memoized.
+
+    Interactive sessions and the milestone queries repeat terms
+    constantly; after the first load a repeated term costs a dict hit
+    instead of a decode. The returned arrays are treated as read-only
+    by every caller, so sharing them across queries is safe.
+    """
+    entry = _get_term_offsets().get(term)
+    if entry is None:
+        return _EMPTY_POSTINGS
+    offset, length = entry
+    # Zero-copy: the decoder reads straight out of the mapped file.
+    view = _get_final_index_view()
+    return decode_postings_arrays(view[offset:offset + length])
 
 
 def load_query_postings(query_terms):
-    """Load postings only for query terms by scanning partial indexes.
+    """Load postings only for query terms, as (doc_ids, tfs) array pairs.
 
-    This avoids loading the full inverted index into memory.
+    Pure dispatch: the merged final index (mmap + offsets) is the fast
+    path, the SQLite table the alternate backend, and the partial files
+    the fallback for indexes that were never merged. Each backend has
+    its own loader with no shared merge layer, so the common path pays
+    nothing for the fallback's bookkeeping.
     """
     needed_terms = set(query_terms)
-    merged = {term: defaultdict(int) for term in needed_terms}
 
-    # Prefer merged final index if available.
     if os.path.exists(FINAL_INDEX_FILE):
-        with open(FINAL_INDEX_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                if ":" not in line:
-                    continue
+        return _load_from_final(needed_terms)
+    if os.path.exists(SQLITE_INDEX_PATH):
+        return _load_from_sqlite(needed_terms)
+    return _load_from_partials(needed_terms)
 
-                term = line.split(":", 1)[0]
-                if term not in needed_terms:
-                    continue
 
-                _, postings = parse_postings_line(line)
-                for doc_id, tf in postings.items():
-                    merged[term][doc_id] += tf
-        return {term: dict(doc_tf) for term, doc_tf in merged.items()}
+def _load_from_final(needed_terms):
+    """Per-term mmap slices from the merged index; memoized per term."""
+    build_term_offsets_if_missing()
+    return {term: _load_one_term(term) for term in needed_terms}
 
-    if not os.path.isdir(PARTIAL_INDEX_DIR):
-        raise FileNotFoundError(
-            "No index files found. Run `python indexer.py` to generate final_index/final_index.txt."
-        )
 
-    for filename in sorted(os.listdir(PARTIAL_INDEX_DIR)):
-        if not filename.startswith("partial_"):
-            continue
+def _load_from_sqlite(needed_terms):
+    """One IN-query against the SQLite backend: a B-tree probe per term."""
+    con = _get_sqlite_index()
+    placeholders = ",".join("?" * len(needed_terms))
+    rows = con.execute(
+        f"SELECT term, postings FROM idx WHERE term IN ({placeholders})",
+        list(needed_terms),
+    )
+    postings_by_term = {term: _EMPTY_POSTINGS for term in needed_terms}
+    for term, blob in rows:
+        postings_by_term[term] = decode_postings_arrays(blob)
+    return postings_by_term
 
-        file_path = os.path.join(PARTIAL_INDEX_DIR, filename)
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                if ":" not in line:
-                    continue
 
-                term = line.split(":", 1)[0]
-                if term not in needed_terms:
-                    continue
+def _load_from_partials(needed_terms):
+    """Scan the partial files and merge per-term postings across them."""
+    if not os.path.isdir(PARTIAL_INDEX_DIR):
+        raise FileNotFoundError(
+            "No index files found. Run `python indexer.py` to generate final_index/final_index.bin."
+        )
 
-                _, postings = parse_postings_line(line)
-                # Merge postings from all partial files for the same term.
-                for doc_id, tf in postings.items():
-                    merged[term][doc_id] += tf
+    partial_paths = [
+        os.path.join(PARTIAL_INDEX_DIR, filename)
+        for filename in sorted(os.listdir(PARTIAL_INDEX_DIR))
+        if filename.startswith("partial_")
+    ]
+
+    # Each partial scan is an independent linear pass, so fan them out
+    # across processes when there is more than one file.
+    if len(partial_paths) > 1:
+        with mp.Pool(min(len(partial_paths), os.cpu_count())) as pool:
+            scans = pool.starmap(
+                _scan_partial, [(path, needed_terms) for path in partial_paths]
+            )
+    else:
+        scans = [_scan_partial(path, needed_terms) for path in partial_paths]
+
+    collected = defaultdict(list)
+    for found in scans:
+        for term, blob in found.items():
+            collected[term].append(decode_postings_arrays(blob))
+
+    # Merge postings from all partial files for the same term.
+    postings_by_term = {}
+    for term in needed_terms:
+        pairs = collected.get(term)
+        if not pairs:
+            postings_by_term[term] = _EMPTY_POSTINGS
+        elif len(pairs) == 1:
+            postings_by_term[term] = pairs[0]
+        else:
+            postings_by_term[term] = _merge_term_arrays(pairs)
+    return postings_by_term
 
-    return {term: dict(doc_tf) for term, doc_tf in merged.items()}
 
+def _scan_partial(file_path, needed_terms):
+    """Scan one partial file for needed terms (runs in a worker process).
 
-def and_search(query, doc_id_map, top_k=5):
+    Frames records over the mapped file directly: the length prefix
+    jumps over each blob without touching it, the term is compared as
+    raw bytes against the needed set, and only matching blobs are ever
+    copied out. (A regex or automaton over the whole file would
+    false-match inside the binary blobs, so exact framing is the
+    fastest safe skip.) Terms are unique within a file, so the scan
+    stops as soon as every needed term has been found. Returns raw
+    blobs; the parent decodes them with the compiled kernel.
+    """
+    needed = {term.encode("utf-8") for term in needed_terms}
+    found = {}
+    with open(file_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        size = len(mm)
+        pos = 0
+        while pos < size and len(found) < len(needed):
+            first_tab = mm.find(b"\t", pos)
+            if first_tab == -1:
+                break
+            second_tab = mm.find(b"\t", first_tab + 1)
+            blob_len = int(mm[first_tab + 1:second_tab])
+            blob_start = second_tab + 1
+            term = mm[pos:first_tab]
+            if term in needed:
+                found[term.decode("utf-8")] = mm[blob_start:blob_start + blob_len]
+            pos = blob_start + blob_len + 1
+    finally:
+        mm.close()
+    return found
+
+
+def and_search(query, doc_id_map, top_k=5, postings_by_term=None):
     """Run Boolean AND retrieval and return top_k ranked URLs.
 
-    Ranking is tf-idf on the boolean-filtered candidate set.
+    Ranking is tf-idf on the boolean-filtered candidate set. A caller
+    running several queries can pass preloaded postings_by_term
+    (covering at least this query's terms) to share one index pass
+    across the batch.
     """
     terms = normalize_query(query)
     if not terms:
         return []
 
-    postings_by_term = load_query_postings(terms)
-    term_docs = []
+    if postings_by_term is None:
+        postings_by_term = load_query_postings(terms)
 
     for term in terms:
-        postings = postings_by_term.get(term, {})
-        if postings:
-            term_docs.append(set(postings.keys()))
-        else:
+        doc_ids, _ = postings_by_term.get(term, _EMPTY_POSTINGS)
+        if not doc_ids.size:
             # If any term is missing, AND query has no results.
             return []
 
-    if not term_docs:
-        return []
-
-    candidate_docs = set.intersection(*term_docs)
-
-    if not candidate_docs:
-        return []
+    # Document-at-a-time evaluation, vectorized: the posting lists are
+    # advanced in lockstep, shortest list (df ascending) first, with a
+    # binary search jumping each longer list to the surviving candidates.
+    # positions[t] holds, for every surviving candidate, its cursor into
+    # term t's posting arrays; every filter step below keeps the cursors
+    # aligned, so scoring later gathers tfs directly instead of
+    # re-searching each list.
+    ordered = sorted(
+        {term: postings_by_term[term][0] for term in terms}.items(),
+        key=lambda item: item[1].size,
+    )
+    first_term, candidates = ordered[0]
+    positions = {first_term: np.arange(candidates.size)}
+    for term, doc_ids in ordered[1:]:
+        idx = np.searchsorted(doc_ids, candidates)
+        # Candidates beyond the last element can't match; clamping them to
+        # slot 0 is safe because doc_ids[0] is smaller than they are.
+        idx[idx == doc_ids.size] = 0
+        mask = doc_ids[idx] == candidates
+        candidates = candidates[mask]
+        if candidates.size == 0:
+            return []
+        for seen in positions:
+            positions[seen] = positions[seen][mask]
+        positions[term] = idx[mask]
 
     total_docs = len(doc_id_map)
-    idf = {}
-    for term in terms:
-        df = len(postings_by_term[term])
-        # Smoothed IDF.
-        idf[term] = math.log((total_docs + 1) / (df + 1)) + 1.0
-
-    scored = []
-    for doc_id in candidate_docs:
-        score = 0.0
-        for term in terms:
-            tf = postings_by_term[term].get(doc_id, 0)
-            if tf > 0:
-                # Log-scaled TF.
-                score += (1 + math.log(tf)) * idf[term]
-        scored.append((doc_id, score))
-
-    scored.sort(key=lambda item: (-item[1], item[0]))
-
-    results = []
-    seen_urls = set()
-    for doc_id, score in scored:
-        url = doc_id_map.get(doc_id, "")
-        if url in seen_urls:
-            continue
-        seen_urls.add(url)
-        results.append(
-            {
-                "doc_id": doc_id,
-                "url": url,
-                "score": round(score, 6),
-            }
+    idf_table = _get_idf_table()
+    idf = np.empty(len(terms), dtype=np.float32)
+    for i, term in enumerate(terms):
+        # Smoothed IDF: precomputed at index time when available.
+        table_idf = idf_table.get(term)
+        if table_idf is not None:
+            idf[i] = table_idf
+        else:
+            doc_ids, _ = postings_by_term[term]
+            idf[i] = math.log((total_docs + 1) / (doc_ids.size + 1)) + 1.0
+
+    max_tf_table = _get_max_tf_table()
+    if candidates.size > MAXSCORE_MIN_CANDIDATES and len(terms) > 1 and max_tf_table:
+        candidates, scores = _score_with_maxscore(
+            terms, postings_by_term, idf, candidates, positions, max_tf_table, top_k
         )
-        if len(results) >= top_k:
-            break
+    else:
+        # Every candidate carries every term (AND) and its cursor into
+        # each list is already known, so the weight gather is two plain
+        # fancy indexes (postings, then the log table) followed by one
+        # idf-weighted reduction over the terms x candidates matrix.
+        # float32 throughout: half the memory traffic of float64, and
+        # far more precision than the 6 decimals scores are reported
+        # with.
+        weights = np.empty((len(terms), candidates.size), dtype=np.float32)
+        for i, term in enumerate(terms):
+            _, tfs = postings_by_term[term]
+            weights[i] = _LOG_TF[tfs[positions[term]]]
+        scores = idf @ weights
+
+    # Rank on the same 6-decimal precision the scores are reported with,
+    # so docs whose reported scores tie are actually ordered by the
+    # doc_id tie-break below. Both scoring paths produce bit-identical
+    # floats: MaxScore re-scores its survivors with this same reduction.
+    scores = np.round(scores.astype(np.float64), 6)
+
+    # Partial top-k selection: only the few returned docs need exact
+    # order, so argpartition the rest away instead of sorting everything.
+    # URL duplicates were folded into canonical doc IDs at index time, so
+    # no dedup slack is needed here.
+    k_select = min(top_k, candidates.size)
+    if k_select < candidates.size:
+        part = np.argpartition(-scores, k_select - 1)[:k_select]
+        # Pull in every candidate tied with the boundary score so the
+        # doc_id tie-break below stays deterministic at the cutoff.
+        top_idx = np.flatnonzero(scores >= scores[part].min())
+    else:
+        top_idx = np.arange(candidates.size)
+
+    # Order by descending score, then ascending doc_id for ties.
+    order = top_idx[np.lexsort((candidates[top_idx], -scores[top_idx]))][:top_k]
+
+    return [
+        {
+            "doc_id": int(candidates[i]),
+            "url": doc_id_map.get(int(candidates[i]), ""),
+            "score": float(scores[i]),
+        }
+        for i in order
+    ]
+
+
+def _score_with_maxscore(terms, postings_by_term, idf, candidates, positions, max_tf_table, top_k):
+    """Score candidates term-by-term with MaxScore-style pruning.
+
+    Terms are taken in descending order of their score ceiling
+    (1 + log(max_tf)) * idf. After each term is added, any candidate
+    whose partial score plus the ceilings of the remaining terms cannot
+    reach the current k-th best partial score is dropped; its final
+    score provably cannot enter the top k. The few survivors are then
+    re-scored with the same matrix reduction as the unpruned path, so
+    both paths return bit-identical scores. Returns the surviving
+    (candidates, scores).
+    """
+    upper_bounds = np.array(
+        [
+            _LOG_TF[min(max_tf_table.get(term, 1), 0xFFFF)] * idf[i]
+            for i, term in enumerate(terms)
+        ],
+        dtype=np.float32,
+    )
+
+    partial = np.zeros(candidates.size, dtype=np.float32)
+    remaining = upper_bounds.sum()
 
-    return results
+    for i in np.argsort(-upper_bounds):
+        term = terms[i]
+        _, tfs = postings_by_term[term]
+        remaining -= upper_bounds[i]
+
+        partial += _LOG_TF[tfs[positions[term]]] * idf[i]
+
+        if candidates.size > top_k:
+            # k-th best partial is a lower bound on the k-th best final
+            # score; the epsilon keeps float-order ties on the safe side
+            # (sized for float32 accumulation).
+            theta = np.partition(partial, -top_k)[-top_k]
+            keep = partial + remaining >= theta - 1e-4
+            if keep.sum() < candidates.size:
+                candidates = candidates[keep]
+                partial = partial[keep]
+                positions = {t: pos[keep] for t, pos in positions.items()}
+
+    weights = np.empty((len(terms), candidates.size), dtype=np.float32)
+    for i, term in enumerate(terms):
+        _, tfs = postings_by_term[term]
+        weights[i] = _LOG_TF[tfs[positions[term]]]
+    return candidates, idf @ weights
 
 
 def run_milestone_queries(doc_id_map, top_k=5):
     """Execute the 4 required milestone queries and print top results."""
+    # The queries share terms; one batched load covers all of them
+    # instead of four separate index passes.
+    all_terms = set()
+    for query in MILESTONE_QUERIES:
+        all_terms.update(normalize_query(query))
+    shared_postings = load_query_postings(all_terms)
+
     all_results = {}
     for i, query in enumerate(MILESTONE_QUERIES, start=1):
         print("=" * 80)
         print(f"Query {i}: {query}")
-        results = and_search(query, doc_id_map, top_k=top_k)
+        results = and_search(query, doc_id_map, top_k=top_k, postings_by_term=shared_postings)
         all_results[query] = results
 
         if not results:
@@ -292,7 +681,7 @@ def main():
     )
     args = parser.parse_args()
 
-    doc_id_map = build_doc_id_map_if_missing()
+    doc_id_map = load_doc_url_map()
 
     if args.milestone2:
         milestone_results = run_milestone_queries(doc_id_map, top_k=args.topk)